@@ -1,4 +1,9 @@
 from .optimizer import ProductOptimizationEngine
-from .prompts import PRODUCT_OPTIMIZATION_PROMPT
+from .prompts import PRODUCT_OPTIMIZATION_PROMPT, PRODUCT_OPTIMIZATION_STATIC_PREFIX, PRODUCT_OPTIMIZATION_DYNAMIC_SUFFIX
 
-__all__ = ["ProductOptimizationEngine", "PRODUCT_OPTIMIZATION_PROMPT"]
+__all__ = [
+    "ProductOptimizationEngine",
+    "PRODUCT_OPTIMIZATION_PROMPT",
+    "PRODUCT_OPTIMIZATION_STATIC_PREFIX",
+    "PRODUCT_OPTIMIZATION_DYNAMIC_SUFFIX"
+]
@@ -0,0 +1,53 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+import orjson
+from cachetools import TTLCache
+
+
+class LLMCache:
+    """In-memory LRU+TTL cache for LLM completions with single-flight lookups."""
+
+    def __init__(self, maxsize: int = 4096, ttl: int = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(model: str, max_tokens: int, temperature: float, prompt: Any) -> str:
+        payload = orjson.dumps({
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "prompt": prompt
+        }, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        if key in self._cache:
+            self.stats["hits"] += 1
+            return self._cache[key]
+
+        # Concurrent requests for the same key share one in-flight fetch task.
+        # The task is only forgotten once it finishes, so a failed or cancelled
+        # caller can never let a second fetch for the same key start alongside it.
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._on_fetch_done(key, done))
+        else:
+            self.stats["hits"] += 1
+
+        # Shield so one caller being cancelled doesn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def _on_fetch_done(self, key: str, task: "asyncio.Future[str]") -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        # Retrieving the exception also keeps asyncio from logging it when no caller is left
+        if task.exception() is None:
+            self._cache[key] = task.result()
@@ -1,16 +1,28 @@
 import json
+import orjson
 import asyncio
 from typing import Dict, List, Any, Optional
 import anthropic
+import httpx
 import os
+import time
+from contextvars import ContextVar
 from datetime import datetime
 import logging
 
 from models.product import ProductInput, OptimizedProduct
-from engine.prompts import PRODUCT_OPTIMIZATION_PROMPT, SCHEMA_GENERATION_PROMPT, SHADOW_PAGE_PROMPT
+from engine.llm_cache import LLMCache
+from engine.prompts import (
+    PRODUCT_OPTIMIZATION_STATIC_PREFIX, SCHEMA_GENERATION_STATIC_PREFIX, SHADOW_PAGE_STATIC_PREFIX,
+    render_product_prompt, render_product_batch_item, render_product_batch_prompt, render_schema_prompt, render_shadow_prompt
+)
 
 logger = logging.getLogger(__name__)
 
+# Token usage for the batch running in the current context; the engine itself is shared,
+# so per-batch figures can't be derived from its lifetime stats
+_batch_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("batch_usage", default=None)
+
 class ProductOptimizationEngine:
     def __init__(self, api_key: str):
         if not api_key:
@@ -18,35 +30,54 @@ class ProductOptimizationEngine:
         
         self.api_key = api_key
         
+        # Every LLM call from any entry point takes a permit in _complete, so
+        # the pool only needs one connection per permit. Zero permits would hang every call.
+        self.max_concurrent = max(1, int(os.getenv("MAX_CONCURRENT_LLM", "16")))
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        max_connections = self.max_concurrent
+        
         # Updated Anthropic client initialization
         try:
-            self.client = anthropic.Anthropic(
+            # Explicit pool so keep-alive connections are reused across requests
+            self.client = anthropic.AsyncAnthropic(
                 api_key=api_key,
                 timeout=30.0,
-                max_retries=3
+                max_retries=2,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                    http2=True
+                )
             )
         except Exception as e:
-            logger.error(f"Failed to initialize Anthropic client: {str(e)}")
+            logger.error("Failed to initialize Anthropic client: %s", e)
             # Fallback initialization
-            self.client = anthropic.Anthropic(api_key=api_key)
+            self.client = anthropic.AsyncAnthropic(api_key=api_key)
         
         self.model = os.getenv("AI_MODEL", "claude-3-5-sonnet-20241022")
         self.max_tokens = int(os.getenv("MAX_TOKENS", "3000"))
+        self.max_batch_tokens = int(os.getenv("MAX_BATCH_TOKENS", "8192"))
+        self.cache = LLMCache(maxsize=4096, ttl=3600)
+        self.stats = {"input_tokens": 0, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
         
-        logger.info(f"ProductOptimizationEngine initialized successfully")
+        logger.info("ProductOptimizationEngine initialized successfully")
         
-    async def optimize_product(self, product: ProductInput) -> OptimizedProduct:
+    async def optimize_product(self, product: ProductInput, optimization_data: Optional[Dict[str, Any]] = None) -> OptimizedProduct:
         try:
-            logger.info(f"Starting optimization for product: {product.product_id}")
+            logger.info("Starting optimization for product: %s", product.product_id)
             
-            # Generate AI optimizations
-            optimization_data = await self._generate_optimizations(product)
+            # Generate AI optimizations unless a batched call already produced them
+            if optimization_data is None:
+                optimization_data = await self._generate_optimizations(product)
             
-            # Generate schemas
-            schema_data = await self._generate_schemas(product, optimization_data)
+            # Serialize once; both follow-up prompts embed the same JSON
+            product_json = product.model_dump_json(indent=2)
+            optimization_json = orjson.dumps(optimization_data, option=orjson.OPT_INDENT_2).decode()
             
-            # Generate shadow page
-            shadow_content = await self._generate_shadow_page(product, optimization_data)
+            # Generate schemas and shadow page concurrently (both only depend on optimization_data)
+            schema_data, shadow_content = await asyncio.gather(
+                self._generate_schemas(product, optimization_data, product_json, optimization_json),
+                self._generate_shadow_page(product, optimization_data, product_json, optimization_json)
+            )
             
             # Generate meta data
             meta_data = self._generate_meta_data(product, optimization_data)
@@ -69,39 +100,95 @@ class ProductOptimizationEngine:
                 optimization_score=optimization_score
             )
             
-            logger.info(f"Successfully optimized product: {product.product_id}")
+            logger.info("Successfully optimized product: %s", product.product_id)
             return optimized_product
             
         except Exception as e:
-            logger.error(f"Optimization failed for product {product.product_id}: {str(e)}")
+            logger.error("Optimization failed for product %s: %s", product.product_id, e)
             raise Exception(f"Product optimization failed: {str(e)}")
     
     async def optimize_batch(self, products: List[ProductInput], options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        start_time = datetime.now()
+        start_time = time.perf_counter()
+        batch_usage = {key: 0 for key in self.stats}
+        # Set before the workers are created so every task they spawn inherits it
+        usage_token = _batch_usage.set(batch_usage)
         results = []
         errors = []
         
-        max_concurrent = options.get('max_concurrent', 2) if options else 2  # Reduced for stability
-        semaphore = asyncio.Semaphore(max_concurrent)
+        options = options or {}
+        # At least one worker, otherwise queue.join() below would never return
+        max_concurrent = max(1, options.get('max_concurrent', self.max_concurrent))
+        batched = options.get('batched', False)
+        chunk_size = max(1, options.get('batch_size', 5)) if batched else 1
         
-        async def optimize_with_semaphore(product):
-            async with semaphore:
+        async def optimize_or_record_error(product, optimization_data=None):
+            try:
+                return await self.optimize_product(product, optimization_data)
+            except Exception as e:
+                errors.append({
+                    "product_id": product.product_id,
+                    "error": str(e)
+                })
+                return None
+        
+        async def optimize_chunk(chunk):
+            if not batched:
+                return [await optimize_or_record_error(chunk[0])]
+            
+            try:
+                chunk_data = await self._generate_optimizations_batched(chunk)
+            except Exception as e:
+                errors.extend({"product_id": product.product_id, "error": str(e)} for product in chunk)
+                return [None] * len(chunk)
+            
+            if chunk_data is None:
+                return await asyncio.gather(*(optimize_or_record_error(product) for product in chunk))
+            
+            return await asyncio.gather(*(
+                optimize_or_record_error(product, optimization_data)
+                for product, optimization_data in zip(chunk, chunk_data)
+            ))
+        
+        # A fixed pool of workers drains the queue, so only max_concurrent
+        # coroutines exist at a time regardless of batch size
+        queue = asyncio.Queue()
+        for index in range(0, len(products), chunk_size):
+            queue.put_nowait((index, products[index:index + chunk_size]))
+        optimization_results = [None] * len(products)
+        
+        async def worker():
+            while True:
+                index, chunk = await queue.get()
                 try:
-                    return await self.optimize_product(product)
-                except Exception as e:
-                    errors.append({
-                        "product_id": product.product_id,
-                        "error": str(e)
-                    })
-                    return None
+                    optimization_results[index:index + len(chunk)] = await optimize_chunk(chunk)
+                finally:
+                    queue.task_done()
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(max_concurrent, queue.qsize()))]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            _batch_usage.reset(usage_token)
         
-        optimization_tasks = [optimize_with_semaphore(product) for product in products]
-        optimization_results = await asyncio.gather(*optimization_tasks, return_exceptions=True)
+        # optimize_or_record_error records failures in errors and returns None
+        total_score = 0.0
+        for result in optimization_results:
+            if result is not None:
+                results.append(result)
+                total_score += result.optimization_score
         
-        results = [result for result in optimization_results if result is not None and not isinstance(result, Exception)]
+        processing_time = time.perf_counter() - start_time
+        avg_score = total_score / len(results) if results else 0
         
-        processing_time = (datetime.now() - start_time).total_seconds()
-        avg_score = sum(r.optimization_score for r in results) / len(results) if results else 0
+        # Share of prompt tokens served from Anthropic's prompt cache during this batch.
+        # None when nothing was read from or written to the cache, i.e. the prefixes
+        # were too short to cache, so an inactive cache isn't reported as a 0% hit rate.
+        total_input = sum(batch_usage.values())
+        cache_active = batch_usage['cache_read_input_tokens'] or batch_usage['cache_creation_input_tokens']
+        cache_hit_rate = batch_usage['cache_read_input_tokens'] / total_input if cache_active else None
         
         return {
             "total_products": len(products),
@@ -110,107 +197,207 @@ class ProductOptimizationEngine:
             "results": results,
             "errors": errors,
             "processing_time": processing_time,
-            "average_optimization_score": avg_score
+            "average_optimization_score": avg_score,
+            "cache_hit_rate": cache_hit_rate
         }
     
-    async def _generate_optimizations(self, product: ProductInput) -> Dict[str, Any]:
-        prompt = PRODUCT_OPTIMIZATION_PROMPT.format(
+    def _render_product_data(self, product: ProductInput) -> str:
+        return render_product_prompt(
             title=product.title,
             description=product.description,
             price=product.price,
             currency=product.currency,
             category=product.category,
             brand=product.brand,
-            attributes=json.dumps(product.attributes),
+            attributes=orjson.dumps(product.attributes).decode(),
             sku=product.sku or "N/A",
             color=product.color or "N/A",
             size=product.size or "N/A",
             material=product.material or "N/A"
         )
+    
+    async def _generate_optimizations(self, product: ProductInput) -> Dict[str, Any]:
+        prompt = self._render_product_data(product)
         
         try:
-            logger.info("Making request to Anthropic API...")
+            logger.debug("Making request to Anthropic API...")
             
             # Enhanced error handling for API calls
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=0.3,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            content = await self._complete(PRODUCT_OPTIMIZATION_STATIC_PREFIX, prompt, temperature=0.3, expect_json=True)
             
-            logger.info("Received response from Anthropic API")
+            logger.debug("Received response from Anthropic API")
             
-            content = response.content[0].text
-            if content.startswith('```json'):
-                content = content.replace('```json', '').replace('```', '').strip()
+            content = content.strip().removeprefix('```json').removeprefix('```').removesuffix('```').strip()
             
-            parsed_content = json.loads(content)
-            logger.info("Successfully parsed AI response")
+            parsed_content = orjson.loads(content)
+            logger.debug("Successfully parsed AI response")
             
             return parsed_content
             
-        except anthropic.AuthenticationError as e:
-            logger.error(f"Anthropic authentication failed: {str(e)}")
-            raise Exception(f"Invalid API key. Please check your Anthropic API key: {str(e)}")
-        except anthropic.RateLimitError as e:
-            logger.error(f"Anthropic rate limit exceeded: {str(e)}")
-            raise Exception(f"Rate limit exceeded. Please try again later: {str(e)}")
         except anthropic.APIError as e:
-            logger.error(f"Anthropic API error: {str(e)}")
-            raise Exception(f"Anthropic API error: {str(e)}")
+            raise self._api_error(e)
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse AI response as JSON: {e}")
-            logger.error(f"Raw response content: {content if 'content' in locals() else 'No content'}")
+            logger.error("Failed to parse AI response as JSON: %s", e)
+            logger.error("Raw response content: %s", content if 'content' in locals() else 'No content')
             raise Exception("Invalid AI response format")
         except Exception as e:
-            logger.error(f"Unexpected error in AI optimization: {str(e)}")
+            logger.error("Unexpected error in AI optimization: %s", e)
             raise Exception(f"AI service error: {str(e)}")
     
-    async def _generate_schemas(self, product: ProductInput, optimization_data: Dict) -> Dict[str, Any]:
+    def _api_error(self, e: anthropic.APIError) -> Exception:
+        if isinstance(e, anthropic.AuthenticationError):
+            logger.error("Anthropic authentication failed: %s", e)
+            return Exception(f"Invalid API key. Please check your Anthropic API key: {str(e)}")
+        if isinstance(e, anthropic.RateLimitError):
+            logger.error("Anthropic rate limit exceeded: %s", e)
+            return Exception(f"Rate limit exceeded. Please try again later: {str(e)}")
+        logger.error("Anthropic API error: %s", e)
+        return Exception(f"Anthropic API error: {str(e)}")
+    
+    async def _generate_optimizations_batched(self, products: List[ProductInput]) -> Optional[List[Dict[str, Any]]]:
+        # Returns None when the response can't be mapped back to the products,
+        # so the caller can fall back to one optimization call per product
+        by_id = {product.product_id: product for product in products}
+        if len(by_id) != len(products):
+            # Results are matched by product_id, which must be unique within the chunk
+            return None
+        
+        # Same cached static prefix as the single-product prompt; only the suffix lists several products
+        prompt = render_product_batch_prompt(
+            count=len(products),
+            products="".join(
+                render_product_batch_item(
+                    number=number,
+                    product_id=orjson.dumps(product.product_id).decode(),
+                    product_data=self._render_product_data(product)
+                )
+                for number, product in enumerate(products, start=1)
+            )
+        )
+        max_tokens = min(self.max_tokens * len(products), self.max_batch_tokens)
+        
         try:
-            prompt = SCHEMA_GENERATION_PROMPT.format(
-                product_data=json.dumps(product.dict(), indent=2),
-                optimized_content=json.dumps(optimization_data, indent=2)
+            content = await self._complete(
+                PRODUCT_OPTIMIZATION_STATIC_PREFIX, prompt, temperature=0.3, expect_json=True, max_tokens=max_tokens
             )
-            
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=0.2,
-                messages=[{"role": "user", "content": prompt}]
+            content = content.strip().removeprefix('```json').removeprefix('```').removesuffix('```').strip()
+            parsed_content = orjson.loads(content)
+        except anthropic.APIError as e:
+            raise self._api_error(e)
+        except json.JSONDecodeError as e:
+            logger.warning("Failed to parse batched AI response as JSON, falling back to per-product calls: %s", e)
+            return None
+        except Exception as e:
+            logger.error("Unexpected error in batched AI optimization: %s", e)
+            raise Exception(f"AI service error: {str(e)}")
+        
+        if not isinstance(parsed_content, list) or len(parsed_content) != len(products):
+            logger.warning("Batched AI response did not contain %s products, falling back to per-product calls", len(products))
+            return None
+        
+        # Match results to products by the echoed product_id rather than position, so a
+        # reordered or duplicated array can't attach one product's content to another
+        optimizations = {}
+        for item in parsed_content:
+            if not isinstance(item, dict):
+                logger.warning("Batched AI response contained a non-object item, falling back to per-product calls")
+                return None
+            product_id = item.pop('product_id', None)
+            if not isinstance(product_id, str) or product_id not in by_id or product_id in optimizations:
+                logger.warning("Batched AI response had a missing, unknown or duplicate product_id %r, falling back to per-product calls", product_id)
+                return None
+            optimizations[product_id] = item
+        
+        return [optimizations[product.product_id] for product in products]
+    
+    async def _generate_schemas(self, product: ProductInput, optimization_data: Dict, product_json: str, optimization_json: str) -> Dict[str, Any]:
+        try:
+            prompt = render_schema_prompt(
+                product_data=product_json,
+                optimized_content=optimization_json
             )
             
-            content = response.content[0].text
-            if content.startswith('```json'):
-                content = content.replace('```json', '').replace('```', '').strip()
+            content = await self._complete(SCHEMA_GENERATION_STATIC_PREFIX, prompt, temperature=0.2, expect_json=True)
+            
+            content = content.strip().removeprefix('```json').removeprefix('```').removesuffix('```').strip()
             
-            return json.loads(content)
+            return orjson.loads(content)
             
         except Exception as e:
-            logger.warning(f"Schema generation failed, using fallback: {e}")
+            logger.warning("Schema generation failed, using fallback: %s", e)
             return self._generate_basic_schema(product, optimization_data)
     
-    async def _generate_shadow_page(self, product: ProductInput, optimization_data: Dict) -> str:
+    async def _generate_shadow_page(self, product: ProductInput, optimization_data: Dict, product_json: str, optimization_json: str) -> str:
         try:
-            prompt = SHADOW_PAGE_PROMPT.format(
-                product_data=json.dumps(product.dict(), indent=2),
-                optimized_data=json.dumps(optimization_data, indent=2)
+            prompt = render_shadow_prompt(
+                product_data=product_json,
+                optimized_data=optimization_json
             )
             
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=0.4,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            return response.content[0].text
+            return await self._complete(SHADOW_PAGE_STATIC_PREFIX, prompt, temperature=0.4)
             
         except Exception as e:
-            logger.warning(f"Shadow page generation failed, using fallback: {e}")
+            logger.warning("Shadow page generation failed, using fallback: %s", e)
             return self._generate_basic_shadow_page(product, optimization_data)
     
+    async def _complete(self, static_prefix: str, prompt: str, temperature: float, expect_json: bool = False, max_tokens: Optional[int] = None) -> str:
+        max_tokens = max_tokens or self.max_tokens
+        messages = self._build_messages(static_prefix, prompt)
+        key = self.cache.make_key(self.model, max_tokens, temperature, messages)
+        
+        async def fetch() -> str:
+            chunks = []
+            checked = not expect_json
+            # Engine-wide limit shared by batches and single-product requests alike
+            async with self._semaphore, self.client.messages.stream(
+                model=self.model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=messages
+            ) as stream:
+                async for text in stream.text_stream:
+                    chunks.append(text)
+                    if not checked:
+                        # Abort early instead of paying for a completion we can't parse
+                        head = "".join(chunks).lstrip()
+                        if head:
+                            if head[0] not in "{[`":
+                                raise json.JSONDecodeError("AI response is not JSON", head, 0)
+                            checked = True
+                message = await stream.get_final_message()
+            self._record_usage(message.usage)
+            content = "".join(chunks)
+            if expect_json and message.stop_reason == "max_tokens":
+                # Truncated JSON can't parse; fail here so it's never cached
+                raise json.JSONDecodeError("AI response truncated at max_tokens", content, len(content))
+            return content
+        
+        return await self.cache.get_or_fetch(key, fetch)
+    
+    def _record_usage(self, usage) -> None:
+        input_tokens = usage.input_tokens or 0
+        cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_creation = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        
+        logger.debug("Token usage: input=%s cache_read=%s cache_creation=%s", input_tokens, cache_read, cache_creation)
+        
+        batch_usage = _batch_usage.get()
+        for totals in (self.stats, batch_usage) if batch_usage is not None else (self.stats,):
+            totals['input_tokens'] += input_tokens
+            totals['cache_read_input_tokens'] += cache_read
+            totals['cache_creation_input_tokens'] += cache_creation
+    
+    def _build_messages(self, static_prefix: str, dynamic_part: str) -> List[Dict[str, Any]]:
+        # Static instructions go first and are marked cacheable so Anthropic
+        # can reuse the prefix across every product in a batch
+        return [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": static_prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": dynamic_part}
+            ]
+        }]
+    
     def _generate_meta_data(self, product: ProductInput, optimization_data: Dict) -> Dict[str, Any]:
         return {
             "meta_title": optimization_data.get('ai_title', product.title)[:60],
@@ -1,17 +1,7 @@
-PRODUCT_OPTIMIZATION_PROMPT = """
-You are an expert e-commerce AI optimization specialist. Optimize this product data for AI shopping assistants like ChatGPT, Google Gemini, Perplexity, and DeepSeek.
+from string import Formatter
 
-PRODUCT DATA:
-Title: {title}
-Description: {description}
-Price: ${price} {currency}
-Category: {category}
-Brand: {brand}
-Attributes: {attributes}
-SKU: {sku}
-Color: {color}
-Size: {size}
-Material: {material}
+PRODUCT_OPTIMIZATION_STATIC_PREFIX = """
+You are an expert e-commerce AI optimization specialist. Optimize the product data that follows for AI shopping assistants like ChatGPT, Google Gemini, Perplexity, and DeepSeek.
 
 Create content that performs exceptionally well when AI assistants search for and recommend products.
 
@@ -50,41 +40,70 @@ Create content that performs exceptionally well when AI assistants search for an
 - Include voice search patterns
 
 Return your response in this exact JSON format:
-{{
+{
   "ai_title": "optimized title here",
   "ai_description": "benefit-led description here",
   "semantic_tags": ["tag1", "tag2", "tag3"],
   "use_cases": ["use case 1", "use case 2"],
   "faq_content": [
-    {{"question": "question 1", "answer": "answer 1"}},
-    {{"question": "question 2", "answer": "answer 2"}}
+    {"question": "question 1", "answer": "answer 1"},
+    {"question": "question 2", "answer": "answer 2"}
   ],
   "ai_summary": "concise summary here",
   "conversational_queries": ["query1", "query2"]
-}}
+}
+"""
+
+PRODUCT_OPTIMIZATION_DYNAMIC_SUFFIX = """
+PRODUCT DATA:
+Title: {title}
+Description: {description}
+Price: ${price} {currency}
+Category: {category}
+Brand: {brand}
+Attributes: {attributes}
+SKU: {sku}
+Color: {color}
+Size: {size}
+Material: {material}
 """
 
-SCHEMA_GENERATION_PROMPT = """
-Generate JSON-LD schema markup for this product optimized for AI assistants.
+# Backwards-compatible full template (usable with str.format) for callers that
+# imported the combined prompt before it was split for caching
+PRODUCT_OPTIMIZATION_PROMPT = (
+    PRODUCT_OPTIMIZATION_STATIC_PREFIX.replace("{", "{{").replace("}", "}}")
+    + PRODUCT_OPTIMIZATION_DYNAMIC_SUFFIX
+)
 
-PRODUCT: {product_data}
-OPTIMIZED CONTENT: {optimized_content}
+PRODUCT_OPTIMIZATION_BATCH_ITEM = """
+PRODUCT {number} (product_id: {product_id}):{product_data}"""
+
+PRODUCT_OPTIMIZATION_BATCH_SUFFIX = """
+Optimize each of the following {count} products.
+{products}
+Return a JSON array of exactly {count} objects, one per product, each in the exact JSON format shown above plus a "product_id" field that repeats the product's product_id exactly as given.
+"""
+
+SCHEMA_GENERATION_STATIC_PREFIX = """
+Generate JSON-LD schema markup for the product that follows, optimized for AI assistants.
 
 Create Product, FAQ, and Review schemas that help AI understand and recommend this product.
 
 Return as valid JSON-LD in this format:
-{{
-  "product_schema": {{"@context": "https://schema.org/", "@type": "Product", "name": "...", "description": "..."}},
-  "faq_schema": {{"@context": "https://schema.org/", "@type": "FAQPage", "mainEntity": [...]}},
+{
+  "product_schema": {"@context": "https://schema.org/", "@type": "Product", "name": "...", "description": "..."},
+  "faq_schema": {"@context": "https://schema.org/", "@type": "FAQPage", "mainEntity": [...]},
   "review_schema": null
-}}
+}
 """
 
-SHADOW_PAGE_PROMPT = """
-Create AI-optimized HTML content for this product's shadow page.
-
+SCHEMA_GENERATION_DYNAMIC_SUFFIX = """
 PRODUCT: {product_data}
-OPTIMIZED DATA: {optimized_data}
+OPTIMIZED CONTENT: {optimized_content}
+"""
+
+SHADOW_PAGE_STATIC_PREFIX = """
+Create AI-optimized HTML content for the shadow page of the product that follows.
 
 Create comprehensive HTML content with:
 - Benefit-focused headlines
@@ -94,3 +113,36 @@ Create comprehensive HTML content with:
 
 Return clean HTML content ready for deployment.
 """
+
+SHADOW_PAGE_DYNAMIC_SUFFIX = """
+PRODUCT: {product_data}
+OPTIMIZED DATA: {optimized_data}
+"""
+
+def _compile_template(template):
+    # Parse the {field} placeholders once at import time instead of on every render
+    return tuple((literal, field) for literal, field, _, _ in Formatter().parse(template))
+
+def _render(parts, values):
+    return "".join(literal if field is None else literal + str(values[field]) for literal, field in parts)
+
+_PRODUCT_PROMPT_PARTS = _compile_template(PRODUCT_OPTIMIZATION_DYNAMIC_SUFFIX)
+_PRODUCT_BATCH_ITEM_PARTS = _compile_template(PRODUCT_OPTIMIZATION_BATCH_ITEM)
+_PRODUCT_BATCH_PROMPT_PARTS = _compile_template(PRODUCT_OPTIMIZATION_BATCH_SUFFIX)
+_SCHEMA_PROMPT_PARTS = _compile_template(SCHEMA_GENERATION_DYNAMIC_SUFFIX)
+_SHADOW_PROMPT_PARTS = _compile_template(SHADOW_PAGE_DYNAMIC_SUFFIX)
+
+def render_product_prompt(**kwargs):
+    return _render(_PRODUCT_PROMPT_PARTS, kwargs)
+
+def render_product_batch_item(**kwargs):
+    return _render(_PRODUCT_BATCH_ITEM_PARTS, kwargs)
+
+def render_product_batch_prompt(**kwargs):
+    return _render(_PRODUCT_BATCH_PROMPT_PARTS, kwargs)
+
+def render_schema_prompt(**kwargs):
+    return _render(_SCHEMA_PROMPT_PARTS, kwargs)
+
+def render_shadow_prompt(**kwargs):
+    return _render(_SHADOW_PROMPT_PARTS, kwargs)
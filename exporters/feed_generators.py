@@ -1,8 +1,7 @@
 import csv
 import io
-from typing import List
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+from typing import Iterator, List
+from xml.etree.ElementTree import Element, SubElement, indent, tostring
 
 class FeedExporter:
     def generate_google_merchant_xml(self, products) -> str:
@@ -22,18 +21,28 @@ class FeedExporter:
             if product.semantic_tags:
                 SubElement(item, 'g:custom_label_0').text = '|'.join(product.semantic_tags[:5])
         
-        rough_string = tostring(rss, 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ")
+        indent(rss, space="  ")
+        return tostring(rss, encoding="unicode", xml_declaration=True)
     
     def generate_meta_tiktok_csv(self, products) -> str:
-        output = io.StringIO()
-        writer = csv.writer(output)
+        return ''.join(self.iter_meta_tiktok_csv_rows(products))
+    
+    def iter_meta_tiktok_csv_rows(self, products, rows_per_chunk: int = 500) -> Iterator[str]:
+        # Yield blocks of rows rather than single lines; StreamingResponse runs sync
+        # iterators in a thread pool, so each yield costs a dispatch
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        
+        def flush() -> str:
+            block = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return block
         
         headers = ['id', 'title', 'description', 'availability', 'condition', 'custom_label_0']
         writer.writerow(headers)
         
-        for product in products:
+        for count, product in enumerate(products, start=1):
             row = [
                 product.product_id,
                 product.ai_title,
@@ -43,5 +52,8 @@ class FeedExporter:
                 '|'.join(product.semantic_tags[:5]) if product.semantic_tags else ''
             ]
             writer.writerow(row)
+            if count % rows_per_chunk == 0:
+                yield flush()
         
-        return output.getvalue()
+        if buffer.tell():
+            yield flush()
@@ -1,9 +1,9 @@
 from fastapi import FastAPI, HTTPException, Request, Form, File, UploadFile
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import uuid
 import logging
 from datetime import datetime
@@ -11,9 +11,19 @@ import os
 import json
 import csv
 import io
+from itertools import chain, repeat
 from dotenv import load_dotenv
+from pydantic import TypeAdapter
+from cachetools import TTLCache
 import anthropic
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
 load_dotenv()
 
 from models.product import ProductInput, OptimizedProduct, BatchOptimizationRequest
@@ -44,7 +54,10 @@ templates = Jinja2Templates(directory="templates")
 
 # Initialize services
 exporter = FeedExporter()
-batch_results = {}
+product_list_adapter = TypeAdapter(List[ProductInput])
+# Bounded so completed batches expire instead of accumulating in memory
+batch_results = TTLCache(maxsize=256, ttl=3600)
+optimizer_singleton: Optional[ProductOptimizationEngine] = None
 
 # API Key extraction
 def get_api_key():
@@ -53,6 +66,13 @@ def get_api_key():
         raise HTTPException(status_code=500, detail="API key not configured")
     return api_key
 
+# Reuse one engine so the Anthropic client keeps its connection pool warm
+def get_optimizer() -> ProductOptimizationEngine:
+    global optimizer_singleton
+    if optimizer_singleton is None:
+        optimizer_singleton = ProductOptimizationEngine(api_key=get_api_key())
+    return optimizer_singleton
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
@@ -110,8 +130,7 @@ async def test_api_key():
 @app.post("/api/optimize-product")
 async def optimize_product(product: ProductInput):
     try:
-        api_key = get_api_key()
-        optimizer = ProductOptimizationEngine(api_key=api_key)
+        optimizer = get_optimizer()
         result = await optimizer.optimize_product(product)
         return result
     except Exception as e:
@@ -120,8 +139,7 @@ async def optimize_product(product: ProductInput):
 @app.post("/api/optimize-batch")
 async def optimize_batch(request: BatchOptimizationRequest):
     try:
-        api_key = get_api_key()
-        optimizer = ProductOptimizationEngine(api_key=api_key)
+        optimizer = get_optimizer()
         
         batch_id = request.batch_id or str(uuid.uuid4())
         result = await optimizer.optimize_batch(request.products, request.optimization_options)
@@ -145,40 +163,100 @@ async def optimize_batch(request: BatchOptimizationRequest):
 
 @app.get("/api/batch-result/{batch_id}")
 async def get_batch_result(batch_id: str):
-    if batch_id not in batch_results:
+    result = batch_results.get(batch_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Batch not found")
-    return batch_results[batch_id]
+    return result
+
+# Columns upload_csv maps onto ProductInput; anything else in the file is skipped
+CSV_COLUMNS = {
+    "id", "product_id", "title", "name", "description", "price", "category",
+    "brand", "currency", "sku", "color", "size", "material"
+}
+
+def open_csv_reader(contents: bytes):
+    # Decode lazily rather than holding a second, decoded copy of the upload
+    return csv.reader(io.TextIOWrapper(io.BytesIO(contents), encoding='utf-8-sig', newline=''))
+
+# Column-oriented CSV read of the mapped columns only; pyarrow parses in C++ when available
+def read_csv_columns(contents: bytes) -> Tuple[Dict[str, List[str]], int]:
+    header = next(open_csv_reader(contents), [])
+    wanted = [name for name in header if name in CSV_COLUMNS]
+    
+    # Duplicate header names go to the stdlib path so they resolve the way DictReader did
+    if pa_csv is not None and header and len(set(header)) == len(header):
+        try:
+            table = pa_csv.read_csv(
+                io.BytesIO(contents),
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=wanted,
+                    column_types={name: pa.string() for name in wanted},
+                    strings_can_be_null=False
+                )
+            )
+            return {name: table.column(name).to_pylist() for name in wanted}, table.num_rows
+        except pa.ArrowInvalid:
+            # pyarrow rejects short rows; the stdlib reader below pads them
+            pass
+    
+    # Like DictReader, the last occurrence of a duplicated header name wins
+    positions = {name: index for index, name in enumerate(header) if name in CSV_COLUMNS}
+    columns = {name: [] for name in positions}
+    row_count = 0
+    
+    reader = open_csv_reader(contents)
+    next(reader, None)
+    for record in reader:
+        if not record:
+            continue
+        row_count += 1
+        for name, index in positions.items():
+            columns[name].append(record[index] if index < len(record) else "")
+    
+    return columns, row_count
 
 @app.post("/api/upload-csv")
 async def upload_csv(file: UploadFile = File(...)):
     try:
         contents = await file.read()
-        decoded = contents.decode('utf-8')
+        columns, row_count = read_csv_columns(contents)
+        
+        def column(*names, default=""):
+            for name in names:
+                if name in columns:
+                    return columns[name]
+            return repeat(default, row_count)
         
-        # Parse CSV
-        csv_reader = csv.DictReader(io.StringIO(decoded))
-        products = []
+        rows = []
         
-        for row in csv_reader:
+        for product_id, title, description, price, category, brand, currency, sku, color, size, material in zip(
+            column("id", "product_id", default=None), column("title", "name"), column("description"),
+            column("price", default=0), column("category"), column("brand"), column("currency", default="USD"),
+            column("sku"), column("color"), column("size"), column("material")
+        ):
             # Basic mapping
             product_data = {
-                "product_id": row.get("id", row.get("product_id", f"prod-{len(products)+1}")),
-                "title": row.get("title", row.get("name", "")),
-                "description": row.get("description", ""),
-                "price": float(row.get("price", 0) or 0),
-                "category": row.get("category", ""),
-                "brand": row.get("brand", ""),
-                "currency": row.get("currency", "USD"),
-                "sku": row.get("sku", ""),
-                "color": row.get("color", ""),
-                "size": row.get("size", ""),
-                "material": row.get("material", "")
+                "product_id": product_id if product_id is not None else f"prod-{len(rows)+1}",
+                "title": title,
+                "description": description,
+                "price": float(price or 0),
+                "category": category,
+                "brand": brand,
+                "currency": currency,
+                "sku": sku,
+                "color": color,
+                "size": size,
+                "material": material
             }
             
             # Validate required fields
             if all([product_data["product_id"], product_data["title"], product_data["description"], 
                    product_data["price"] > 0, product_data["category"], product_data["brand"]]):
-                products.append(ProductInput(**product_data))
+                rows.append(product_data)
+        
+        # Validate all rows in one pass rather than constructing models one by one
+        products = product_list_adapter.validate_python(rows)
         
         return {
             "message": f"Successfully parsed {len(products)} products",
@@ -190,11 +268,12 @@ async def upload_csv(file: UploadFile = File(...)):
 
 @app.get("/api/export/google-merchant/{batch_id}")
 async def export_google_merchant(batch_id: str):
-    if batch_id not in batch_results:
+    result = batch_results.get(batch_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Batch not found")
     
     try:
-        products = batch_results[batch_id]['results']
+        products = result['results']
         xml_content = exporter.generate_google_merchant_xml(products)
         
         return Response(
@@ -207,15 +286,20 @@ async def export_google_merchant(batch_id: str):
 
 @app.get("/api/export/meta-csv/{batch_id}")
 async def export_meta_csv(batch_id: str):
-    if batch_id not in batch_results:
+    result = batch_results.get(batch_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Batch not found")
     
     try:
-        products = batch_results[batch_id]['results']
-        csv_content = exporter.generate_meta_tiktok_csv(products)
+        products = result['results']
         
-        return Response(
-            content=csv_content,
+        # Render the first block here so row errors still surface as a 500
+        # instead of truncating a response that has already started
+        blocks = exporter.iter_meta_tiktok_csv_rows(products)
+        first_block = next(blocks, '')
+        
+        return StreamingResponse(
+            chain([first_block], blocks),
             media_type="text/csv",
             headers={"Content-Disposition": f"attachment; filename=meta_feed_{batch_id}.csv"}
         )